@@ -1,6 +1,13 @@
 import json
 import boto3
 import os
+import time
+
+from mqcommon import (isProfilingRequested, profileSpan, profileInvocation, startScheduling,
+    getAlarmReason, scheduleWork, drainWork, isAdaptiveRefreshEnabled, isRefreshAllRequested,
+    loadRefreshSchedule, getDueBrokers, saveRefreshSchedule, scheduleDashboard, resetBodyStats,
+    printBodyStats, getActiveInstanceNames, hasTimeToDiscover, existingDashboards, getDashboardReason,
+    compactDashboardBody)
 
 # AWS API clients
 mq = boto3.client(service_name='mq', region_name=os.environ['MQ_REGION'])
@@ -8,6 +15,7 @@ cw = boto3.client(service_name='cloudwatch', region_name=os.environ['MQ_REGION']
 ssm = boto3.client(service_name='ssm', region_name=os.environ['MQ_REGION'])
 
 topicArn = os.environ['SNS_TOPIC_ARN']
+refreshSchedulePath = '/MQBrokerDashboardSchedule'
 
 # Dashboard names can only have a dash or underscore.
 def getObjectDashboardName(objectName):
@@ -42,7 +50,8 @@ def getListOfQueuesAndTopics(brokerName, queueList, topicList):
             elif dimensions['Name'] == 'Queue':
                 queueList.add(dimensions['Value'])
 
-# Generates a CW dashboard for each broker including a list of queues and topics
+# Generates a CW dashboard for each broker including a list of queues and topics.
+# Returns the queues and topics found.
 def generateBrokerDashboard(brokerName, brokerRegion):
     # Init queueList set.
     queueList = set()
@@ -54,60 +63,90 @@ def generateBrokerDashboard(brokerName, brokerRegion):
 
     # MQ client does not have API for listing queues and topics.
     # Use the CW client to get the queue and topic list.
-    getListOfQueuesAndTopics(brokerName, queueList, topicList)
-
-    # Initialize the queue list markdown
-    objectListMd = """\n ## Broker metrics for **%s**\n\n ## Queues \n %s \n\n"""
-
-    yPos = 0
-    for queueName in queueList:
-        # Add queue and topic dashboard URLs to markdown
-        objectListMd += generateObjectURLMd(queueName, queueName, brokerName, brokerRegion)
-        summaryJson = json.loads(queues_summary_template, strict=False)
-        yPos += 3
-        summaryJson['y'] += yPos
-        summaryJson['properties']['metrics'][0][3] = brokerName
-        summaryJson['properties']['metrics'][0][5] = queueName
-        summaryJson['properties']['region'] = brokerRegion
-        summaryJson['properties']['title'] = queueName
-        queueSummary.append(summaryJson)
-
-
-    objectListMd += """\n ## Topics \n %s \n\n"""
-
-    yPos = 0
-    for topicName in topicList:
-        # Add queue and topic dashboard URLs to markdown
-        objectListMd += generateObjectURLMd(topicName, topicName, brokerName, brokerRegion)
-        summaryJson = json.loads(topics_summary_template, strict=False)
-        yPos += 3
-        summaryJson['y'] += yPos
-        summaryJson['properties']['metrics'][0][3] = brokerName
-        summaryJson['properties']['metrics'][0][5] = topicName
-        summaryJson['properties']['region'] = brokerRegion
-        summaryJson['properties']['title'] = topicName
-        topicSummary.append(summaryJson)
-
-    queueSummaryWidget["widgets"] = queueSummary
-    topicSummaryWidget['widgets'] = topicSummary
+    with profileSpan(brokerName + ':discover'):
+        getListOfQueuesAndTopics(brokerName, queueList, topicList)
+
+    with profileSpan(brokerName + ':render'):
+        # Initialize the queue list markdown
+        objectListMd = """\n ## Broker metrics for **%s**\n\n ## Queues \n %s \n\n"""
+
+        yPos = 0
+        for queueName in queueList:
+            # Add queue and topic dashboard URLs to markdown
+            objectListMd += generateObjectURLMd(queueName, queueName, brokerName, brokerRegion)
+            summaryJson = json.loads(queues_summary_template, strict=False)
+            yPos += 3
+            summaryJson['y'] += yPos
+            summaryJson['properties']['metrics'][0][3] = brokerName
+            summaryJson['properties']['metrics'][0][5] = queueName
+            summaryJson['properties']['region'] = brokerRegion
+            summaryJson['properties']['title'] = queueName
+            queueSummary.append(summaryJson)
+
+
+        objectListMd += """\n ## Topics \n %s \n\n"""
+
+        yPos = 0
+        for topicName in topicList:
+            # Add queue and topic dashboard URLs to markdown
+            objectListMd += generateObjectURLMd(topicName, topicName, brokerName, brokerRegion)
+            summaryJson = json.loads(topics_summary_template, strict=False)
+            yPos += 3
+            summaryJson['y'] += yPos
+            summaryJson['properties']['metrics'][0][3] = brokerName
+            summaryJson['properties']['metrics'][0][5] = topicName
+            summaryJson['properties']['region'] = brokerRegion
+            summaryJson['properties']['title'] = topicName
+            topicSummary.append(summaryJson)
+
+        queueSummaryWidget["widgets"] = queueSummary
+        topicSummaryWidget['widgets'] = topicSummary
 
     if len(queueSummary) > 0:
-        cw.put_dashboard(DashboardName=brokerName + '-QueueSummary', DashboardBody=json.dumps(queueSummaryWidget))
+        scheduleDashboard(brokerName + '-QueueSummary', queueSummaryWidget, brokerName)
     if len(topicSummary) > 0:
-        cw.put_dashboard(DashboardName=brokerName + '-TopicSummary', DashboardBody=json.dumps(topicSummaryWidget))
+        scheduleDashboard(brokerName + '-TopicSummary', topicSummaryWidget, brokerName)
 
-    finalMd = objectListMd % (brokerName, generateObjectURLMd(brokerName + '-QueueSummary', "Summary of Queues", None, brokerRegion), generateObjectURLMd(brokerName + '-TopicSummary', "Summary of Topics", None, brokerRegion))
+    with profileSpan(brokerName + ':render'):
+        finalMd = objectListMd % (brokerName, generateObjectURLMd(brokerName + '-QueueSummary', "Summary of Queues", None, brokerRegion), generateObjectURLMd(brokerName + '-TopicSummary', "Summary of Topics", None, brokerRegion))
+        brokerJson = renderBrokerJson(brokerName, brokerRegion, finalMd)
+    scheduleDashboard(brokerName, brokerJson, brokerName)
+    return queueList | topicList
 
-    # Read the broker dashboard template to generate a new dashboard for each broker
-    # A separate dahsboard is generated for each broker and link to this dashboard is added
-    # to AmazonMQ dashboard.
+# Generates a placeholder dashboard for the standby instance of an active/standby broker.
+# It keeps the broker health charts and links to the active instance instead of listing
+# queues and topics, which the standby does not publish. Queue and topic summaries left
+# from before a failover are replaced with placeholders that link to the active instance's
+# summaries. Only summaries that exist and still differ in size from their placeholder are
+# written.
+def generateStandbyDashboard(brokerName, activeName, brokerRegion):
+    with profileSpan(brokerName + ':render'):
+        standbyMd = """\n ## Broker metrics for **%s** (standby)\n\n Queues and topics are listed on the active instance %s""" % (
+            brokerName, generateObjectURLMd(activeName, activeName, None, brokerRegion))
+        brokerJson = renderBrokerJson(brokerName, brokerRegion, standbyMd)
+    scheduleDashboard(brokerName, brokerJson, brokerName)
+
+    for summaryName, displayName in [('-QueueSummary', "Summary of Queues"), ('-TopicSummary', "Summary of Topics")]:
+        if brokerName + summaryName not in existingDashboards:
+            continue
+        with profileSpan(brokerName + ':render'):
+            standbyJson = json.loads(standby_summary_template, strict=False)
+            standbyJson['widgets'][0]['properties']['markdown'] = """\n ## %s for **%s** (standby)\n\n The standby instance publishes no queue or topic metrics. See %s""" % (
+                displayName, brokerName, generateObjectURLMd(activeName + summaryName, displayName + " on " + activeName, None, brokerRegion))
+        if getDashboardReason(brokerName + summaryName, compactDashboardBody(standbyJson)) != 'refresh':
+            scheduleDashboard(brokerName + summaryName, standbyJson, brokerName)
+
+# Read the broker dashboard template to generate a new dashboard for each broker
+# A separate dahsboard is generated for each broker and link to this dashboard is added
+# to AmazonMQ dashboard.
+def renderBrokerJson(brokerName, brokerRegion, markdown):
     brokerJson = json.loads(broker_dashboard_template, strict=False)
-    brokerJson['widgets'][0]['properties']['markdown'] = finalMd
+    brokerJson['widgets'][0]['properties']['markdown'] = markdown
     for widget in brokerJson['widgets']:
         if widget['type'] == 'metric':
             widget['properties']['metrics'][0][3] = brokerName
             widget['properties']['region'] = brokerRegion
-    cw.put_dashboard(DashboardName=brokerName, DashboardBody=json.dumps(brokerJson))
+    return brokerJson
 
 def put_broker_alarms(brokerName):
     cw.put_metric_alarm(
@@ -187,27 +226,35 @@ def put_broker_alarms(brokerName):
     )
 
 
+def getBrokerAlarmNames(brokerName):
+    return ['BrokerHeapUsage-'+ brokerName, 'BrokerStoreUsage-'+ brokerName, 'BrokerCPUUtilization-'+ brokerName]
+
 def delete_broker_alarms(brokerName):
     cw.delete_alarms(
-        AlarmNames=[
-            'BrokerHeapUsage-'+ brokerName, 'BrokerStoreUsage-'+ brokerName, 'BrokerCPUUtilization-'+ brokerName
-        ]
+        AlarmNames=getBrokerAlarmNames(brokerName)
     )
 
 
-def lambda_handler(event, context):
+def generateDashboards(event, context):
     global broker_dashboard_template
     global queues_summary_template
     global topics_summary_template
+    global standby_summary_template
     global provisionAlarms
 
-    version = '0.4'
+    version = '0.10'
     """
     Notes:
     Version 0.1: Initial Release. No support for topics yet.  
     Version 0.2: Added support for topics. Added queue and topics summary dashboards. 
     Version 0.3: Paramterize the dashboard.
     Version 0.4: Add broker alarms.                 
+    Version 0.5: Write compact dashboard bodies.
+    Version 0.6: Add opt-in profiling.
+    Version 0.7: Write missing and changed dashboards and alarms first.
+    Version 0.8: Placeholder dashboard for the standby instance.
+    Version 0.9: Adaptive per-broker refresh cadence.
+    Version 0.10: Placeholder queue and topic summaries for the standby instance.
     """
 
     queues_summary_template = """
@@ -253,6 +300,23 @@ def lambda_handler(event, context):
     }
     """
 
+    standby_summary_template = """
+    {
+      "widgets": [
+        {
+          "type": "text",
+          "x": 0,
+          "y": 0,
+          "width": 24,
+          "height": 3,
+          "properties": {
+            "markdown": "\n## Standby instance\n"
+          }
+        }
+      ]
+    }
+    """
+
     broker_dashboard_template = """
     {
       "widgets": [
@@ -335,18 +399,67 @@ def lambda_handler(event, context):
         else:
             provisionAlarms = False
 
-    brokerList = mq.list_brokers()
-    for broker in brokerList['BrokerSummaries']:
+    adaptiveRefresh = isAdaptiveRefreshEnabled()
+    refreshAll = isRefreshAllRequested(event)
+    now = time.time()
+    with profileSpan('discover'):
+        if adaptiveRefresh:
+            loadRefreshSchedule(refreshSchedulePath)
+        brokerList = mq.list_brokers()
+        # Checked on every run so a failover is picked up before the broker is due.
+        activeNames = getActiveInstanceNames([broker['BrokerName'] for broker in brokerList['BrokerSummaries']
+                                              if broker['DeploymentMode'] == 'ACTIVE_STANDBY_MULTI_AZ'])
+    brokers = brokerList['BrokerSummaries']
+    if adaptiveRefresh and not refreshAll:
+        brokers = getDueBrokers(brokers, activeNames, now)
+        if len(brokers) == 0:
+            print("No brokers are due for a refresh")
+            return
+
+    resetBodyStats()
+    with profileSpan('discover'):
+        startScheduling(['BrokerHeapUsage-', 'BrokerStoreUsage-', 'BrokerCPUUtilization-'])
+    refreshedBrokers = dict()
+    skippedBrokers = list()
+    for broker in brokers:
         brokerName = broker['BrokerName']
         brokerRegion = broker['BrokerArn'].split(":")[3]
         deploymentMode = broker['DeploymentMode']
+        if not hasTimeToDiscover(context):
+            skippedBrokers.append(brokerName)
+            continue
         if provisionAlarms:
-            put_broker_alarms(brokerName)
+            scheduleWork(getAlarmReason(getBrokerAlarmNames(brokerName)), 'broker alarms ' + brokerName, brokerName + ':alarms',
+                         put_broker_alarms, brokerName)
         else:
-            delete_broker_alarms(brokerName)
+            scheduleWork('refresh', 'delete broker alarms ' + brokerName, brokerName + ':alarms',
+                         delete_broker_alarms, brokerName)
 
+        destinations = set()
         if deploymentMode == 'SINGLE_INSTANCE':
-            generateBrokerDashboard(brokerName + "-1", brokerRegion)
+            destinations |= generateBrokerDashboard(brokerName + "-1", brokerRegion)
+        elif deploymentMode == 'ACTIVE_STANDBY_MULTI_AZ':
+            activeName = activeNames[brokerName]
+            for instanceName in [brokerName + "-1", brokerName + "-2"]:
+                if activeName is None or instanceName == activeName:
+                    destinations |= generateBrokerDashboard(instanceName, brokerRegion)
+                else:
+                    generateStandbyDashboard(instanceName, activeName, brokerRegion)
         else:
-            generateBrokerDashboard(brokerName + "-1", brokerRegion)
-            generateBrokerDashboard(brokerName + "-2", brokerRegion)
+            destinations |= generateBrokerDashboard(brokerName + "-1", brokerRegion)
+            destinations |= generateBrokerDashboard(brokerName + "-2", brokerRegion)
+        refreshedBrokers[brokerName] = destinations
+
+    leftoverSpans = drainWork(context)
+    if len(skippedBrokers) > 0:
+        print("Left over (not discovered, out of time): " + ", ".join(skippedBrokers))
+    if adaptiveRefresh:
+        brokerNames = [broker['BrokerName'] for broker in brokerList['BrokerSummaries']]
+        saveRefreshSchedule(refreshSchedulePath, brokerNames, refreshedBrokers, activeNames, leftoverSpans, now)
+    printBodyStats()
+
+
+def lambda_handler(event, context):
+    if isProfilingRequested(event):
+        return profileInvocation(generateDashboards, event, context)
+    return generateDashboards(event, context)
@@ -0,0 +1,401 @@
+import contextlib
+import cProfile
+import datetime
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import os
+import pstats
+import time
+import tracemalloc
+import boto3
+
+# Helpers shared by the dashboard generators. This module is packaged as the MQDashboardCommon
+# layer so each function imports the same copy.
+
+# AWS API clients
+cw = boto3.client(service_name='cloudwatch', region_name=os.environ['MQ_REGION'])
+ssm = boto3.client(service_name='ssm', region_name=os.environ['MQ_REGION'])
+
+# Profiling state for the current invocation. Profiling is opt-in through the PROFILE
+# environment variable or a "profile" key in the invocation event.
+profileSpans = dict()
+profileEnabled = False
+
+# Read a profiling setting from the event first and the environment second.
+def getProfileSetting(event, key, envName, default):
+    if isinstance(event, dict) and key in event:
+        return event[key]
+    return os.environ.get(envName, default)
+
+def isProfilingRequested(event):
+    return getProfileSetting(event, 'profile', 'PROFILE', 'NO') in (True, 'YES')
+
+# Accumulate the call count and wall time of a named span while profiling.
+@contextlib.contextmanager
+def profileSpan(name):
+    if not profileEnabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        span = profileSpans.setdefault(name, [0, 0.0])
+        span[0] += 1
+        span[1] += time.perf_counter() - start
+
+# Run a handler under cProfile and tracemalloc, then report spans, allocations and hot functions.
+def profileInvocation(handler, event, context):
+    global profileEnabled
+    profileSpans.clear()
+    profileEnabled = True
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        return handler(event, context)
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        peakBytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        profileEnabled = False
+        # A broken report must not fail a run that succeeded or hide the handler's own error.
+        try:
+            writeProfileReport(event, profiler, snapshot, peakBytes)
+        except Exception as error:
+            print("Profile report failed: %r" % error)
+
+# Directory for the report file. PROFILE_PATH is trusted as deployed; a path from the
+# event must resolve inside /tmp, the only writable directory on Lambda.
+def getProfileOutputPath(event):
+    if isinstance(event, dict) and 'profilePath' in event:
+        outputPath = os.path.realpath(str(event['profilePath']))
+        if outputPath != '/tmp' and not outputPath.startswith('/tmp/'):
+            print("Ignoring profilePath outside /tmp: " + outputPath)
+            return ''
+        return outputPath
+    return os.environ.get('PROFILE_PATH', '')
+
+# Print the top-N report to the log, or write it (and optionally the raw stats) to a file.
+def writeProfileReport(event, profiler, snapshot, peakBytes):
+    topN = int(getProfileSetting(event, 'profileTop', 'PROFILE_TOP', '20'))
+    outputPath = getProfileOutputPath(event)
+    report = io.StringIO()
+    report.write("Spans (calls, seconds):\n")
+    for name, span in sorted(profileSpans.items(), key=lambda item: item[1][1], reverse=True):
+        report.write("  %-60s %6d %10.3f\n" % (name, span[0], span[1]))
+    report.write("Peak traced memory: %d bytes\n" % peakBytes)
+    report.write("Top allocations:\n")
+    for stat in snapshot.statistics('lineno')[:topN]:
+        report.write("  %s\n" % stat)
+    report.write("Top functions by cumulative time:\n")
+    pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(topN)
+    if outputPath:
+        os.makedirs(outputPath, exist_ok=True)
+        functionName = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'mqdashboard')
+        prefix = os.path.join(outputPath, functionName + '-' + time.strftime('%Y%m%d-%H%M%S'))
+        with open(prefix + '.txt', 'w') as reportFile:
+            reportFile.write(report.getvalue())
+        if getProfileSetting(event, 'profileRaw', 'PROFILE_RAW', 'NO') in (True, 'YES'):
+            profiler.dump_stats(prefix + '.prof')
+        print("Profile report written to " + prefix + ".txt")
+    else:
+        print(report.getvalue())
+
+# Metric widget properties that CloudWatch applies when they are omitted.
+defaultMetricProperties = {'view': 'timeSeries', 'stacked': False, 'stat': 'Average'}
+
+# Byte counts of the dashboard bodies written during the current invocation.
+bodyStats = {'dashboards': 0, 'rawBytes': 0, 'compactBytes': 0}
+
+# Collapse repeated metric fields into the "." shorthand. In a dashboard body a "."
+# repeats the value found at the same position in the previous metric row.
+def compactMetrics(metrics):
+    compacted = []
+    previous = []
+    for row in metrics:
+        resolved = []
+        compactRow = []
+        for i, value in enumerate(row):
+            if value == "." and i < len(previous) and isinstance(previous[i], str):
+                value = previous[i]
+            resolved.append(value)
+            if isinstance(value, str) and i < len(previous) and previous[i] == value:
+                compactRow.append(".")
+            else:
+                compactRow.append(value)
+        compacted.append(compactRow)
+        previous = resolved
+    return compacted
+
+# Serialize a dashboard without whitespace, shorthand metrics and default properties.
+def compactDashboardBody(dashboardJson):
+    widgets = []
+    for widget in dashboardJson['widgets']:
+        if widget['type'] == 'metric':
+            properties = dict()
+            for key, value in widget['properties'].items():
+                if key in defaultMetricProperties and defaultMetricProperties[key] == value:
+                    continue
+                if key == 'metrics':
+                    value = compactMetrics(value)
+                properties[key] = value
+            widget = dict(widget, properties=properties)
+        widgets.append(widget)
+    return json.dumps(dict(dashboardJson, widgets=widgets), separators=(',', ':'))
+
+# Pending dashboard and alarm writes for the current invocation. Work is queued while
+# brokers are rendered and drained afterwards, lowest priority value first, so new
+# destinations land before routine refreshes when the invocation runs out of time.
+workPriorities = {'missing dashboard': 0, 'missing alarm': 1, 'resized dashboard': 2, 'refresh': 3}
+workQueue = []
+workSequence = itertools.count()
+existingDashboards = dict()
+existingAlarms = set()
+
+# Clear the work queue and load the dashboards and alarms that already exist.
+def startScheduling(alarmPrefixes):
+    del workQueue[:]
+    existingDashboards.clear()
+    for page in cw.get_paginator('list_dashboards').paginate():
+        for entry in page['DashboardEntries']:
+            existingDashboards[entry['DashboardName']] = entry['Size']
+    existingAlarms.clear()
+    for prefix in alarmPrefixes:
+        for page in cw.get_paginator('describe_alarms').paginate(AlarmNamePrefix=prefix):
+            for alarm in page['MetricAlarms']:
+                existingAlarms.add(alarm['AlarmName'])
+
+# list_dashboards only reports the stored size, so a dashboard is ranked as resized when that
+# size differs from the new body. An edit that keeps the size is written as a refresh.
+def getDashboardReason(dashboardName, dashboardBody):
+    if dashboardName not in existingDashboards:
+        return 'missing dashboard'
+    if existingDashboards[dashboardName] != len(dashboardBody.encode('utf-8')):
+        return 'resized dashboard'
+    return 'refresh'
+
+def getAlarmReason(alarmNames):
+    for alarmName in alarmNames:
+        if alarmName not in existingAlarms:
+            return 'missing alarm'
+    return 'refresh'
+
+def scheduleWork(reason, description, spanName, work, *args):
+    heapq.heappush(workQueue, (workPriorities[reason], next(workSequence), reason, description, spanName, work, args))
+
+# Writes only start once discovery is over, so discovery stops while SCHEDULE_RESERVE_MS plus
+# DRAIN_MARGIN_MS of the invocation remain to write what has been rendered.
+def hasTimeToDiscover(context):
+    if context is None:
+        return True
+    reserveMillis = int(os.environ.get('SCHEDULE_RESERVE_MS', '5000')) + int(os.environ.get('DRAIN_MARGIN_MS', '15000'))
+    return context.get_remaining_time_in_millis() >= reserveMillis
+
+# Run queued work until it is done or the remaining time drops below SCHEDULE_RESERVE_MS,
+# then report what was left over. Returns the span prefixes (brokers) that have work left.
+def drainWork(context):
+    reserveMillis = int(os.environ.get('SCHEDULE_RESERVE_MS', '5000'))
+    completed = 0
+    while len(workQueue) > 0:
+        if context is not None and context.get_remaining_time_in_millis() < reserveMillis:
+            break
+        priority, sequence, reason, description, spanName, work, args = heapq.heappop(workQueue)
+        with profileSpan(spanName):
+            work(*args)
+        completed += 1
+    leftover = dict()
+    for item in workQueue:
+        leftover[item[2]] = leftover.get(item[2], 0) + 1
+    print("Scheduled work: %d completed, %d left over %s" % (completed, len(workQueue), json.dumps(leftover)))
+    for item in sorted(workQueue):
+        print("Left over (%s): %s" % (item[2], item[3]))
+    return set(item[4].rsplit(':', 1)[0] for item in workQueue)
+
+# Per-broker refresh cadence. With ADAPTIVE_REFRESH enabled the generator runs on a short
+# schedule and only refreshes brokers that are due. Each broker keeps
+# [next due time, interval in minutes, destination count, destination digest, active instance]
+# in its own Standard tier SSM parameter under the schedule path, so the schedule never
+# outgrows the 4 KB parameter limit. The interval is divided by (churn + 1) when destinations
+# were added or removed or the active instance changed since the last refresh, and doubled
+# when nothing changed, within REFRESH_MIN_MINUTES and REFRESH_MAX_MINUTES.
+refreshSchedule = dict()
+refreshScheduleValues = dict()
+
+def isAdaptiveRefreshEnabled():
+    return os.environ.get('ADAPTIVE_REFRESH', 'NO') == 'YES'
+
+# An event with "refreshAll" refreshes every broker regardless of when it is due.
+def isRefreshAllRequested(event):
+    return isinstance(event, dict) and event.get('refreshAll') in (True, 'YES')
+
+def loadRefreshSchedule(refreshSchedulePath):
+    refreshSchedule.clear()
+    refreshScheduleValues.clear()
+    try:
+        for page in ssm.get_paginator('get_parameters_by_path').paginate(Path=refreshSchedulePath, WithDecryption=False):
+            for parameter in page['Parameters']:
+                brokerName = parameter['Name'].rsplit('/', 1)[1]
+                refreshScheduleValues[brokerName] = parameter['Value']
+                refreshSchedule[brokerName] = json.loads(parameter['Value'])
+    except Exception as e:
+        print("Refresh schedule in %s could not be read, all brokers are due: %r" % (refreshSchedulePath, e))
+        refreshSchedule.clear()
+        refreshScheduleValues.clear()
+
+def isBrokerDue(brokerName, now):
+    return brokerName not in refreshSchedule or refreshSchedule[brokerName][0] <= now
+
+# The active instance recorded at the last refresh, None for single instance brokers and
+# schedules written before it was recorded.
+def getRecordedActiveName(brokerName):
+    entry = refreshSchedule.get(brokerName, [])
+    return entry[4] if len(entry) > 4 else None
+
+# True when the detected active instance differs from the one recorded at the last refresh,
+# including None, recorded when a refresh fell inside the detection window of a failover.
+# An active instance that cannot be detected now is not a change.
+def hasFailedOver(brokerName, activeName):
+    entry = refreshSchedule.get(brokerName, [])
+    return activeName is not None and len(entry) > 4 and entry[4] != activeName
+
+# Brokers due for a refresh, longest overdue first, so brokers left over by an earlier run
+# are discovered before the time budget runs out. Brokers not in the schedule come first.
+# An active/standby broker that failed over is due immediately.
+def getDueBrokers(brokers, activeNames, now):
+    dueBrokers = []
+    for broker in brokers:
+        brokerName = broker['BrokerName']
+        if hasFailedOver(brokerName, activeNames.get(brokerName)):
+            print("Broker %s: active instance changed from %s to %s" % (brokerName, getRecordedActiveName(brokerName), activeNames[brokerName]))
+            dueBrokers.append(broker)
+        elif isBrokerDue(brokerName, now):
+            dueBrokers.append(broker)
+    return sorted(dueBrokers, key=lambda broker: refreshSchedule.get(broker['BrokerName'], [0])[0])
+
+# Destinations are compared by count and digest, so churn is the change in count, and at
+# least one when the set changed without changing size or the broker failed over.
+def updateRefreshSchedule(brokerName, destinations, activeName, now):
+    minMinutes = int(os.environ.get('REFRESH_MIN_MINUTES', '5'))
+    maxMinutes = int(os.environ.get('REFRESH_MAX_MINUTES', '120'))
+    digest = hashlib.md5("\n".join(sorted(destinations)).encode('utf-8')).hexdigest()[:8]
+    if brokerName in refreshSchedule:
+        interval, count, lastDigest = refreshSchedule[brokerName][1:4]
+        churn = 0
+        if digest != lastDigest or hasFailedOver(brokerName, activeName):
+            churn = max(abs(len(destinations) - count), 1)
+        if churn > 0:
+            interval = max(minMinutes, interval // (churn + 1))
+        else:
+            interval = min(maxMinutes, interval * 2)
+    else:
+        churn = len(destinations)
+        interval = minMinutes
+    print("Broker %s: %d destinations, churn %d, next refresh in %d minutes" % (brokerName, len(destinations), churn, interval))
+    refreshSchedule[brokerName] = [int(now) + interval * 60, interval, len(destinations), digest, activeName]
+
+# Record refreshed brokers and save the schedule. Brokers with work left over in the queue
+# stay due, and brokers that no longer exist are dropped. Only entries that differ from the
+# loaded ones are written. A failed write is logged and leaves that broker due.
+def saveRefreshSchedule(refreshSchedulePath, brokerNames, refreshedBrokers, activeNames, leftoverSpans, now):
+    for brokerName, destinations in refreshedBrokers.items():
+        if leftoverSpans.isdisjoint([brokerName, brokerName + "-1", brokerName + "-2"]):
+            updateRefreshSchedule(brokerName, destinations, activeNames.get(brokerName), now)
+    for brokerName in list(refreshSchedule):
+        if brokerName not in brokerNames:
+            del refreshSchedule[brokerName]
+    for brokerName, entry in refreshSchedule.items():
+        value = json.dumps(entry, separators=(',', ':'))
+        if value == refreshScheduleValues.get(brokerName):
+            continue
+        try:
+            ssm.put_parameter(Name=refreshSchedulePath + '/' + brokerName, Value=value, Type='String', Overwrite=True, Tier='Standard')
+            refreshScheduleValues[brokerName] = value
+        except Exception as e:
+            print("Refresh schedule for %s was not saved: %r" % (brokerName, e))
+    removedNames = [refreshSchedulePath + '/' + brokerName for brokerName in refreshScheduleValues if brokerName not in refreshSchedule]
+    # delete_parameters takes up to 10 names per call
+    for offset in range(0, len(removedNames), 10):
+        try:
+            ssm.delete_parameters(Names=removedNames[offset:offset + 10])
+        except Exception as e:
+            print("Refresh schedule entries were not deleted: %r" % e)
+    for name in removedNames:
+        refreshScheduleValues.pop(name.rsplit('/', 1)[1], None)
+
+# Encode a dashboard as a compact body, record its size against the default encoding
+# and queue the write.
+def scheduleDashboard(dashboardName, dashboardJson, brokerName):
+    with profileSpan(brokerName + ':render'):
+        dashboardBody = compactDashboardBody(dashboardJson)
+        bodyStats['dashboards'] += 1
+        bodyStats['rawBytes'] += len(json.dumps(dashboardJson).encode('utf-8'))
+        bodyStats['compactBytes'] += len(dashboardBody.encode('utf-8'))
+    scheduleWork(getDashboardReason(dashboardName, dashboardBody), 'dashboard ' + dashboardName, brokerName + ':write',
+                 putDashboard, dashboardName, dashboardBody)
+
+def putDashboard(dashboardName, dashboardBody):
+    cw.put_dashboard(DashboardName=dashboardName, DashboardBody=dashboardBody)
+
+# Reset the body size counters at the start of an invocation.
+def resetBodyStats():
+    for key in bodyStats:
+        bodyStats[key] = 0
+
+# Log the body size counters at the end of an invocation.
+def printBodyStats():
+    savedBytes = bodyStats['rawBytes'] - bodyStats['compactBytes']
+    print("Dashboard bodies: %d dashboards, %d bytes compact, %d bytes default encoding, %d bytes saved" %
+          (bodyStats['dashboards'], bodyStats['compactBytes'], bodyStats['rawBytes'], savedBytes))
+
+# An active/standby broker runs one broker process at a time, so only the active instance
+# publishes broker metrics. Looks up all brokers with batched get_metric_data calls and maps
+# each to the instance that published TotalConsumerCount within the last
+# ACTIVE_WINDOW_MINUTES, or None when neither or both did (e.g. during a failover).
+def getActiveInstanceNames(brokerNames):
+    endTime = datetime.datetime.utcnow()
+    startTime = endTime - datetime.timedelta(minutes=int(os.environ.get('ACTIVE_WINDOW_MINUTES', '15')))
+    instanceNames = dict()
+    queries = []
+    for i, brokerName in enumerate(brokerNames):
+        for instance in ['1', '2']:
+            queryId = 'b%d_%s' % (i, instance)
+            instanceNames[queryId] = brokerName + "-" + instance
+            queries.append({
+                'Id': queryId,
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': 'AWS/AmazonMQ',
+                        'MetricName': 'TotalConsumerCount',
+                        'Dimensions': [{'Name': 'Broker', 'Value': instanceNames[queryId]}]
+                    },
+                    'Period': 60,
+                    'Stat': 'SampleCount'
+                }
+            })
+    publishing = dict((brokerName, []) for brokerName in brokerNames)
+    # get_metric_data takes up to 500 queries per call
+    for offset in range(0, len(queries), 500):
+        kwargs = {'MetricDataQueries': queries[offset:offset + 500], 'StartTime': startTime, 'EndTime': endTime}
+        while True:
+            resp = cw.get_metric_data(**kwargs)
+            for result in resp['MetricDataResults']:
+                instanceName = instanceNames[result['Id']]
+                if len(result['Values']) > 0 and instanceName not in publishing[instanceName[:-2]]:
+                    publishing[instanceName[:-2]].append(instanceName)
+            if 'NextToken' not in resp:
+                break
+            kwargs['NextToken'] = resp['NextToken']
+    activeNames = dict()
+    for brokerName in brokerNames:
+        if len(publishing[brokerName]) == 1:
+            activeNames[brokerName] = publishing[brokerName][0]
+            print("Broker %s: active instance is %s" % (brokerName, activeNames[brokerName]))
+        else:
+            activeNames[brokerName] = None
+            print("Broker %s: active instance unknown, generating both instances" % brokerName)
+    return activeNames
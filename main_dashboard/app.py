@@ -2,6 +2,8 @@ import json
 import boto3
 import os
 
+from mqcommon import isProfilingRequested, profileSpan, profileInvocation
+
 # AWS API clients
 mq = boto3.client(service_name='mq', region_name=os.environ['MQ_REGION'])
 cw = boto3.client(service_name='cloudwatch', region_name=os.environ['MQ_REGION'])
@@ -15,20 +17,22 @@ def generateBrokerURLMd(brokerName, brokerRegion, isSingle):
     if isSingle:
         retval = """[""" + brokerName + """](https://console.aws.amazon.com/cloudwatch/home?region=""" + brokerRegion + """#dashboards:name=""" + brokerName + """-1)\n\n"""
     else:
-        retval = brokerName + """ [Primary](https://console.aws.amazon.com/cloudwatch/home?region=""" + brokerRegion + """#dashboards:name=""" + brokerName + """-1) [Standby](https://console.aws.amazon.com/cloudwatch/home?region=""" + brokerRegion + """#dashboards:name=""" + brokerName + """-2)\n\n"""
+        retval = brokerName + """ [Instance 1](https://console.aws.amazon.com/cloudwatch/home?region=""" + brokerRegion + """#dashboards:name=""" + brokerName + """-1) [Instance 2](https://console.aws.amazon.com/cloudwatch/home?region=""" + brokerRegion + """#dashboards:name=""" + brokerName + """-2)\n\n"""
     return retval
 
 
-def lambda_handler(event, context):
+def generateDashboards(event, context):
     global dashboard_template
     global alarmEmailOverride
 
-    version = '0.3'
+    version = '0.5'
     """
     Notes:
     Version 0.1: Initial Release.
     Version 0.2: Add support for region. 
     Version 0.3: Add support for customer name customization.                   
+    Version 0.4: Add opt-in profiling.
+    Version 0.5: Label active/standby links by instance, not role.
     """
 
     dashboard_template = """{
@@ -71,19 +75,28 @@ def lambda_handler(event, context):
         sns.subscribe(TopicArn=topicArn, Protocol='email', Endpoint=alarmEmailOverride)
 
     brokerUrlsMd = """## Brokers\n\n"""
-    brokerList = mq.list_brokers()
-    for broker in brokerList['BrokerSummaries']:
-        brokerName = broker['BrokerName']
-        brokerRegion = broker['BrokerArn'].split(":")[3]
-        deploymentMode = broker['DeploymentMode']
-        # For a single instance broker, generate single URL for the broker.
-        # For Active/Standby broker, generate a Primary and Standby link for the broker.
-        if deploymentMode == 'SINGLE_INSTANCE':
-            brokerUrlsMd += generateBrokerURLMd(brokerName, brokerRegion, True)
-        else:
-            brokerUrlsMd += generateBrokerURLMd(brokerName, brokerRegion, False)
-    dashboard_template = dashboard_template % os.environ['CUSTOMER_NAME']
-    mqJson = json.loads(dashboard_template, strict=False)
-    mqJson['widgets'][1]['properties']['markdown'] = brokerUrlsMd
-    cw.put_dashboard(DashboardName="AmazonMQ-" + os.environ['MQ_REGION'], DashboardBody=json.dumps(mqJson))
+    with profileSpan('discover'):
+        brokerList = mq.list_brokers()
+    with profileSpan('render'):
+        for broker in brokerList['BrokerSummaries']:
+            brokerName = broker['BrokerName']
+            brokerRegion = broker['BrokerArn'].split(":")[3]
+            deploymentMode = broker['DeploymentMode']
+            # For a single instance broker, generate single URL for the broker.
+            # For Active/Standby broker, generate a link for each instance. Either instance can be
+            # active, and the standby's dashboard links to the active one.
+            if deploymentMode == 'SINGLE_INSTANCE':
+                brokerUrlsMd += generateBrokerURLMd(brokerName, brokerRegion, True)
+            else:
+                brokerUrlsMd += generateBrokerURLMd(brokerName, brokerRegion, False)
+        dashboard_template = dashboard_template % os.environ['CUSTOMER_NAME']
+        mqJson = json.loads(dashboard_template, strict=False)
+        mqJson['widgets'][1]['properties']['markdown'] = brokerUrlsMd
+    with profileSpan('write'):
+        cw.put_dashboard(DashboardName="AmazonMQ-" + os.environ['MQ_REGION'], DashboardBody=json.dumps(mqJson))
 
+
+def lambda_handler(event, context):
+    if isProfilingRequested(event):
+        return profileInvocation(generateDashboards, event, context)
+    return generateDashboards(event, context)
@@ -2,6 +2,13 @@ import copy
 import json
 import boto3
 import os
+import time
+
+from mqcommon import (isProfilingRequested, profileSpan, profileInvocation, startScheduling,
+    getAlarmReason, scheduleWork, drainWork, isAdaptiveRefreshEnabled, isRefreshAllRequested,
+    loadRefreshSchedule, getDueBrokers, saveRefreshSchedule, scheduleDashboard, resetBodyStats,
+    printBodyStats, getActiveInstanceNames, hasTimeToDiscover, existingDashboards, getDashboardReason,
+    compactDashboardBody)
 
 # AWS API clients
 mq = boto3.client(service_name='mq', region_name=os.environ['MQ_REGION'])
@@ -9,6 +16,7 @@ cw = boto3.client(service_name='cloudwatch', region_name=os.environ['MQ_REGION']
 ssm = boto3.client(service_name='ssm', region_name=os.environ['MQ_REGION'])
 
 topicArn = os.environ['SNS_TOPIC_ARN']
+refreshSchedulePath = '/MQObjectDashboardSchedule'
 
 # Dashboard names can only have a dash or underscore.
 def getObjectDashboardName(objectName, brokerName):
@@ -103,7 +111,8 @@ def delete_queue_alarm(brokerName, queueName):
         ]
     )
 
-# Generates a CW dashboard for each broker including a list of queues and topics
+# Generates a CW dashboard for each broker including a list of queues and topics.
+# Returns the queues and topics found.
 def generateObjectDashboard(brokerName, brokerRegion):
     # Init queueList set.
     queueList = set()
@@ -112,52 +121,85 @@ def generateObjectDashboard(brokerName, brokerRegion):
 
     # MQ client does not have API for listing queues and topics.
     # Use the CW client to get the queue and topic list.
-    getListOfQueuesAndTopics(brokerName, queueList, topicList, advList)
+    with profileSpan(brokerName + ':discover'):
+        getListOfQueuesAndTopics(brokerName, queueList, topicList, advList)
 
     # Read the queue dashboard template to generate a new dashboard for each queue
-    queueTemplateJson = json.loads(queue_dashboard_template, strict=False)
+    with profileSpan(brokerName + ':render'):
+        queueTemplateJson = json.loads(queue_dashboard_template, strict=False)
     for queueName in queueList:
-        queueJson = copy.copy(queueTemplateJson)
-        queueJson['widgets'][0]['properties']['markdown'] = """\n ## Queue metrics for **""" + queueName + """**\n"""
-        for widget in queueJson['widgets']:
-            if widget['type'] == 'metric':
-                widget['properties']['metrics'][0][3] = brokerName
-                widget['properties']['metrics'][0][5] = queueName
-                widget['properties']['region'] = brokerRegion
+        with profileSpan(brokerName + ':render'):
+            queueJson = copy.copy(queueTemplateJson)
+            queueJson['widgets'][0]['properties']['markdown'] = """\n ## Queue metrics for **""" + queueName + """**\n"""
+            for widget in queueJson['widgets']:
+                if widget['type'] == 'metric':
+                    widget['properties']['metrics'][0][3] = brokerName
+                    widget['properties']['metrics'][0][5] = queueName
+                    widget['properties']['region'] = brokerRegion
         if provisionAlarms:
-            put_queue_alarm(brokerName, queueName)
+            scheduleWork(getAlarmReason(['NoConsumer-' + queueName]), 'alarm NoConsumer-' + queueName, brokerName + ':alarms',
+                         put_queue_alarm, brokerName, queueName)
         else:
-            delete_queue_alarm(brokerName, queueName)
-        cw.put_dashboard(DashboardName=getObjectDashboardName(queueName, brokerName), DashboardBody=json.dumps(queueJson))
+            scheduleWork('refresh', 'delete alarm NoConsumer-' + queueName, brokerName + ':alarms',
+                         delete_queue_alarm, brokerName, queueName)
+        scheduleDashboard(getObjectDashboardName(queueName, brokerName), queueJson, brokerName)
 
     # Read the topic dashboard template to generate a new dashboard for each topic
-    topicTemplateJson = json.loads(topic_dashboard_template, strict=False)
+    with profileSpan(brokerName + ':render'):
+        topicTemplateJson = json.loads(topic_dashboard_template, strict=False)
     for topicName in topicList:
-        topicJson = copy.copy(topicTemplateJson)
-        topicJson['widgets'][0]['properties']['markdown'] = """\n ## Topic metrics for **""" + topicName + """**\n"""
-        for widget in topicJson['widgets']:
-            if widget['type'] == 'metric':
-                widget['properties']['metrics'][0][3] = brokerName
-                widget['properties']['metrics'][0][5] = topicName
-                widget['properties']['region'] = brokerRegion
+        with profileSpan(brokerName + ':render'):
+            topicJson = copy.copy(topicTemplateJson)
+            topicJson['widgets'][0]['properties']['markdown'] = """\n ## Topic metrics for **""" + topicName + """**\n"""
+            for widget in topicJson['widgets']:
+                if widget['type'] == 'metric':
+                    widget['properties']['metrics'][0][3] = brokerName
+                    widget['properties']['metrics'][0][5] = topicName
+                    widget['properties']['region'] = brokerRegion
         if provisionAlarms:
-            put_topic_alarm(brokerName, topicName)
+            scheduleWork(getAlarmReason(['NoConsumer-' + topicName]), 'alarm NoConsumer-' + topicName, brokerName + ':alarms',
+                         put_topic_alarm, brokerName, topicName)
         else:
-            delete_topic_alarm(brokerName, topicName)
-        cw.put_dashboard(DashboardName=getObjectDashboardName(topicName, brokerName), DashboardBody=json.dumps(topicJson))
+            scheduleWork('refresh', 'delete alarm NoConsumer-' + topicName, brokerName + ':alarms',
+                         delete_topic_alarm, brokerName, topicName)
+        scheduleDashboard(getObjectDashboardName(topicName, brokerName), topicJson, brokerName)
+    return queueList | topicList
 
-def lambda_handler(event, context):
+# Replaces the queue and topic dashboards of the standby instance, left from before a
+# failover, with placeholders that link to the active instance. Only dashboards that exist
+# and still differ in size from their placeholder are written.
+def generateStandbyObjectDashboards(standbyName, activeName, brokerRegion, objectNames):
+    for objectName in objectNames:
+        dashboardName = getObjectDashboardName(objectName, standbyName)
+        if dashboardName not in existingDashboards:
+            continue
+        with profileSpan(standbyName + ':render'):
+            standbyJson = json.loads(standby_dashboard_template, strict=False)
+            activeDashboardName = getObjectDashboardName(objectName, activeName)
+            standbyJson['widgets'][0]['properties']['markdown'] = """\n ## Metrics for **%s** on **%s** (standby)\n\n The standby instance publishes no queue or topic metrics. See [%s](https://console.aws.amazon.com/cloudwatch/home?region=%s#dashboards:name=%s) on the active instance **%s**.""" % (
+                objectName, standbyName, objectName, brokerRegion, activeDashboardName, activeName)
+        if getDashboardReason(dashboardName, compactDashboardBody(standbyJson)) != 'refresh':
+            scheduleDashboard(dashboardName, standbyJson, standbyName)
+
+def generateDashboards(event, context):
     global queue_dashboard_template
     global topic_dashboard_template
+    global standby_dashboard_template
     global provisionAlarms
 
-    version = '0.4'
+    version = '0.10'
     """
     Notes:
     Version 0.1: Initial Release.
     Version 0.2: Add support for topics. 
     Version 0.3: Parameterize the dashboard.
     Version 0.4: Add queue and topic alarm.                   
+    Version 0.5: Write compact dashboard bodies.
+    Version 0.6: Add opt-in profiling.
+    Version 0.7: Write missing and changed dashboards and alarms first.
+    Version 0.8: Only generate dashboards for the active instance.
+    Version 0.9: Adaptive per-broker refresh cadence.
+    Version 0.10: Placeholder dashboards for the standby instance's queues and topics.
     """
 
     queue_dashboard_template = """
@@ -290,6 +332,23 @@ def lambda_handler(event, context):
     }
     """
 
+    standby_dashboard_template = """
+    {
+      "widgets": [
+        {
+          "type": "text",
+          "x": 1,
+          "y": 0,
+          "width": 21,
+          "height": 3,
+          "properties": {
+            "markdown": "\n## Standby instance\n"
+          }
+        }
+      ]
+    }
+    """
+
     try:
         provisionAlarmsOverride = ssm.get_parameter(Name='MQAlarmToggle', WithDecryption=False)['Parameter']['Value']
         if provisionAlarmsOverride == "YES":
@@ -302,13 +361,64 @@ def lambda_handler(event, context):
         else:
             provisionAlarms = False
 
-    brokerList = mq.list_brokers()
-    for broker in brokerList['BrokerSummaries']:
+    adaptiveRefresh = isAdaptiveRefreshEnabled()
+    refreshAll = isRefreshAllRequested(event)
+    now = time.time()
+    with profileSpan('discover'):
+        if adaptiveRefresh:
+            loadRefreshSchedule(refreshSchedulePath)
+        brokerList = mq.list_brokers()
+        # Checked on every run so a failover is picked up before the broker is due.
+        activeNames = getActiveInstanceNames([broker['BrokerName'] for broker in brokerList['BrokerSummaries']
+                                              if broker['DeploymentMode'] == 'ACTIVE_STANDBY_MULTI_AZ'])
+    brokers = brokerList['BrokerSummaries']
+    if adaptiveRefresh and not refreshAll:
+        brokers = getDueBrokers(brokers, activeNames, now)
+        if len(brokers) == 0:
+            print("No brokers are due for a refresh")
+            return
+
+    resetBodyStats()
+    with profileSpan('discover'):
+        startScheduling(['NoConsumer-'])
+    refreshedBrokers = dict()
+    skippedBrokers = list()
+    for broker in brokers:
         brokerName = broker['BrokerName']
         brokerRegion = broker['BrokerArn'].split(":")[3]
         deploymentMode = broker['DeploymentMode']
+        if not hasTimeToDiscover(context):
+            skippedBrokers.append(brokerName)
+            continue
+        destinations = set()
         if deploymentMode == 'SINGLE_INSTANCE':
-            generateObjectDashboard(brokerName + "-1", brokerRegion)
+            destinations |= generateObjectDashboard(brokerName + "-1", brokerRegion)
+        elif deploymentMode == 'ACTIVE_STANDBY_MULTI_AZ':
+            # The standby publishes no destination metrics, so its queue and topic dashboards
+            # become placeholders that link to the active instance.
+            activeName = activeNames[brokerName]
+            if activeName is None:
+                destinations |= generateObjectDashboard(brokerName + "-1", brokerRegion)
+                destinations |= generateObjectDashboard(brokerName + "-2", brokerRegion)
+            else:
+                destinations |= generateObjectDashboard(activeName, brokerRegion)
+                standbyName = brokerName + "-2" if activeName == brokerName + "-1" else brokerName + "-1"
+                generateStandbyObjectDashboards(standbyName, activeName, brokerRegion, destinations)
         else:
-            generateObjectDashboard(brokerName + "-1", brokerRegion)
-            generateObjectDashboard(brokerName + "-2", brokerRegion)
+            destinations |= generateObjectDashboard(brokerName + "-1", brokerRegion)
+            destinations |= generateObjectDashboard(brokerName + "-2", brokerRegion)
+        refreshedBrokers[brokerName] = destinations
+
+    leftoverSpans = drainWork(context)
+    if len(skippedBrokers) > 0:
+        print("Left over (not discovered, out of time): " + ", ".join(skippedBrokers))
+    if adaptiveRefresh:
+        brokerNames = [broker['BrokerName'] for broker in brokerList['BrokerSummaries']]
+        saveRefreshSchedule(refreshSchedulePath, brokerNames, refreshedBrokers, activeNames, leftoverSpans, now)
+    printBodyStats()
+
+
+def lambda_handler(event, context):
+    if isProfilingRequested(event):
+        return profileInvocation(generateDashboards, event, context)
+    return generateDashboards(event, context)
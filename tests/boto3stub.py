@@ -0,0 +1,70 @@
+import os
+import sys
+import types
+
+# The generators create boto3 clients at import time, so boto3 is replaced with a stub
+# that records dashboard writes and answers the read calls the handlers make.
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(root, 'common', 'python'))
+os.environ.update(MQ_REGION='us-east-1', SNS_TOPIC_ARN='arn:aws:sns:us-east-1:1:ops', INCLUDE_ADVISORY='NO',
+                  PROVISION_ALARMS='YES', ADAPTIVE_REFRESH='NO')
+
+brokerSummaries = [
+    {'BrokerName': 'single', 'BrokerArn': 'arn:aws:mq:us-west-2:1:broker:single', 'DeploymentMode': 'SINGLE_INSTANCE'},
+    {'BrokerName': 'pair', 'BrokerArn': 'arn:aws:mq:us-west-2:1:broker:pair', 'DeploymentMode': 'ACTIVE_STANDBY_MULTI_AZ'}
+]
+
+def brokerMetrics(brokerName):
+    return [
+        {'Dimensions': [{'Name': 'Broker', 'Value': brokerName}, {'Name': 'Queue', 'Value': 'ORDERS.IN'}]},
+        {'Dimensions': [{'Name': 'Broker', 'Value': brokerName}, {'Name': 'Topic', 'Value': 'PRICES'}]}
+    ]
+
+class StubPaginator:
+    def __init__(self, client, operation):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        if self.operation == 'list_dashboards':
+            return [{'DashboardEntries': []}]
+        if self.operation == 'get_parameters_by_path':
+            return [{'Parameters': [{'Name': name, 'Value': value} for name, value in sorted(self.client.parameters.items())
+                                    if name.startswith(kwargs['Path'] + '/')]}]
+        return [{'MetricAlarms': []}]
+
+class StubClient:
+    def __init__(self):
+        self.dashboards = dict()
+        self.parameters = dict()
+
+    def get_paginator(self, operation):
+        return StubPaginator(self, operation)
+
+    def list_brokers(self, **kwargs):
+        return {'BrokerSummaries': brokerSummaries}
+
+    def list_metrics(self, **kwargs):
+        return {'Metrics': brokerMetrics(kwargs['Dimensions'][0]['Value'])}
+
+    def get_metric_data(self, **kwargs):
+        return {'MetricDataResults': [{'Id': query['Id'], 'Values': []} for query in kwargs['MetricDataQueries']]}
+
+    def get_parameter(self, **kwargs):
+        raise Exception('ParameterNotFound')
+
+    def put_parameter(self, **kwargs):
+        self.parameters[kwargs['Name']] = kwargs['Value']
+
+    def delete_parameters(self, **kwargs):
+        for name in kwargs['Names']:
+            self.parameters.pop(name, None)
+
+    def put_dashboard(self, **kwargs):
+        self.dashboards[kwargs['DashboardName']] = kwargs['DashboardBody']
+
+    def __getattr__(self, name):
+        return lambda **kwargs: {}
+
+sys.modules['boto3'] = types.SimpleNamespace(client=lambda **kwargs: StubClient())
+
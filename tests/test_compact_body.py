@@ -0,0 +1,97 @@
+import copy
+import importlib.util
+import json
+import os
+import unittest
+
+import boto3stub
+import mqcommon
+
+def loadApp(name):
+    spec = importlib.util.spec_from_file_location(name + '_app', os.path.join(boto3stub.root, name, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Undo compaction: resolve "." against the previous metric row and restore omitted defaults.
+def expandDashboard(dashboardJson):
+    dashboardJson = copy.deepcopy(dashboardJson)
+    for widget in dashboardJson['widgets']:
+        if widget['type'] != 'metric':
+            continue
+        properties = widget['properties']
+        for key, value in mqcommon.defaultMetricProperties.items():
+            properties.setdefault(key, value)
+        rows = []
+        previous = []
+        for row in properties['metrics']:
+            resolved = []
+            for i, value in enumerate(row):
+                if value == "." and i < len(previous) and isinstance(previous[i], str):
+                    value = previous[i]
+                resolved.append(value)
+            rows.append(resolved)
+            previous = resolved
+        properties['metrics'] = rows
+    return dashboardJson
+
+class CompactMetricsTest(unittest.TestCase):
+
+    def test_repeated_fields_become_shorthand(self):
+        metrics = [
+            ["AWS/AmazonMQ", "EnqueueCount", "Broker", "b-1", "Queue", "Q"],
+            ["AWS/AmazonMQ", "DequeueCount", "Broker", "b-1", "Queue", "Q", {"yAxis": "right"}]
+        ]
+        self.assertEqual(mqcommon.compactMetrics(metrics), [
+            ["AWS/AmazonMQ", "EnqueueCount", "Broker", "b-1", "Queue", "Q"],
+            [".", "DequeueCount", ".", ".", ".", ".", {"yAxis": "right"}]
+        ])
+
+    def test_existing_shorthand_is_resolved_before_comparing(self):
+        metrics = [
+            ["AWS/AmazonMQ", "HeapUsage", "Broker", "b-1"],
+            [".", "CpuUtilization", ".", "."],
+            ["AWS/AmazonMQ", "StorePercentUsage", "Broker", "b-2"]
+        ]
+        self.assertEqual(mqcommon.compactMetrics(metrics), [
+            ["AWS/AmazonMQ", "HeapUsage", "Broker", "b-1"],
+            [".", "CpuUtilization", ".", "."],
+            [".", "StorePercentUsage", ".", "b-2"]
+        ])
+
+class CompactDashboardBodyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rendered = []
+        compactDashboardBody = mqcommon.compactDashboardBody
+
+        def recordingCompactDashboardBody(dashboardJson):
+            dashboardBody = compactDashboardBody(dashboardJson)
+            self.rendered.append((copy.deepcopy(dashboardJson), dashboardBody))
+            return dashboardBody
+
+        mqcommon.compactDashboardBody = recordingCompactDashboardBody
+        self.addCleanup(setattr, mqcommon, 'compactDashboardBody', compactDashboardBody)
+
+    def assertSemanticallyIdentical(self):
+        self.assertTrue(len(self.rendered) > 0)
+        for dashboardJson, dashboardBody in self.rendered:
+            self.assertEqual(expandDashboard(json.loads(dashboardBody)), expandDashboard(dashboardJson))
+            self.assertLess(len(dashboardBody.encode('utf-8')), len(json.dumps(dashboardJson).encode('utf-8')))
+
+    def test_broker_dashboards(self):
+        loadApp('broker_dashboard').lambda_handler({}, None)
+        names = mqcommon.cw.dashboards.keys()
+        for name in ['single-1', 'single-1-QueueSummary', 'single-1-TopicSummary', 'pair-1', 'pair-2']:
+            self.assertIn(name, names)
+        self.assertSemanticallyIdentical()
+
+    def test_object_dashboards(self):
+        loadApp('object_dashboard').lambda_handler({}, None)
+        names = mqcommon.cw.dashboards.keys()
+        for name in ['ORDERS-IN-single-1', 'PRICES-single-1', 'ORDERS-IN-pair-1', 'PRICES-pair-2']:
+            self.assertIn(name, names)
+        self.assertSemanticallyIdentical()
+
+if __name__ == '__main__':
+    unittest.main()
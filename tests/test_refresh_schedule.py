@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import unittest
+
+import boto3stub
+import mqcommon
+
+schedulePath = '/MQBrokerDashboardSchedule'
+now = 1000000
+
+def broker(brokerName):
+    return {'BrokerName': brokerName}
+
+def digest(destinations):
+    return hashlib.md5("\n".join(sorted(destinations)).encode('utf-8')).hexdigest()[:8]
+
+# A schedule entry: [next due time, interval in minutes, destination count, digest, active instance]
+def entry(due, interval=20, destinations=('Q',), activeName=None):
+    return [due, interval, len(destinations), digest(destinations), activeName]
+
+class RefreshScheduleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        mqcommon.refreshSchedule.clear()
+        mqcommon.refreshScheduleValues.clear()
+        mqcommon.ssm.parameters.clear()
+
+class GetDueBrokersTest(RefreshScheduleTestCase):
+
+    def test_unscheduled_then_longest_overdue_first(self):
+        mqcommon.refreshSchedule.update(a=entry(now - 60), b=entry(now - 600), c=entry(now + 60))
+        dueBrokers = mqcommon.getDueBrokers([broker('a'), broker('b'), broker('c'), broker('d')], {}, now)
+        self.assertEqual([b['BrokerName'] for b in dueBrokers], ['d', 'b', 'a'])
+
+    def test_failover_is_due_immediately(self):
+        mqcommon.refreshSchedule.update(pair=entry(now + 60, activeName='pair-1'))
+        self.assertEqual(mqcommon.getDueBrokers([broker('pair')], {'pair': 'pair-1'}, now), [])
+        self.assertEqual(mqcommon.getDueBrokers([broker('pair')], {'pair': 'pair-2'}, now), [broker('pair')])
+
+    def test_active_instance_found_after_unknown_is_due(self):
+        mqcommon.refreshSchedule.update(pair=entry(now + 60, activeName=None))
+        self.assertEqual(mqcommon.getDueBrokers([broker('pair')], {'pair': 'pair-2'}, now), [broker('pair')])
+
+    def test_undetected_active_instance_is_not_due(self):
+        mqcommon.refreshSchedule.update(pair=entry(now + 60, activeName='pair-1'))
+        self.assertEqual(mqcommon.getDueBrokers([broker('pair')], {'pair': None}, now), [])
+
+    def test_entry_without_active_instance_is_not_due(self):
+        mqcommon.refreshSchedule.update(pair=entry(now + 60)[:4])
+        self.assertEqual(mqcommon.getDueBrokers([broker('pair')], {'pair': 'pair-1'}, now), [])
+
+class UpdateRefreshScheduleTest(RefreshScheduleTestCase):
+
+    def refresh(self, destinations, activeName=None):
+        mqcommon.updateRefreshSchedule('a', set(destinations), activeName, now)
+        return mqcommon.refreshSchedule['a']
+
+    def test_new_broker_starts_at_minimum(self):
+        self.assertEqual(self.refresh(['Q'])[:3], [now + 5 * 60, 5, 1])
+
+    def test_unchanged_broker_backs_off_to_maximum(self):
+        mqcommon.refreshSchedule['a'] = entry(now, interval=40)
+        self.assertEqual(self.refresh(['Q'])[:2], [now + 80 * 60, 80])
+        self.assertEqual(self.refresh(['Q'])[:2], [now + 120 * 60, 120])
+        self.assertEqual(self.refresh(['Q'])[1], 120)
+
+    def test_churn_divides_interval_down_to_minimum(self):
+        mqcommon.refreshSchedule['a'] = entry(now, interval=120)
+        self.assertEqual(self.refresh(['Q', 'R', 'S'])[1], 40)
+        self.assertEqual(self.refresh(['Q'])[1], 13)
+        self.assertEqual(self.refresh(['Q', 'R', 'S', 'T', 'U'])[1], 5)
+
+    def test_changed_set_of_same_size_halves_interval(self):
+        mqcommon.refreshSchedule['a'] = entry(now, interval=40)
+        self.assertEqual(self.refresh(['R'])[1], 20)
+
+    def test_failover_halves_interval(self):
+        mqcommon.refreshSchedule['a'] = entry(now, interval=40, activeName='a-1')
+        self.assertEqual(self.refresh(['Q'], 'a-2')[1:], [20, 1, digest(['Q']), 'a-2'])
+
+    def test_bounds_from_environment(self):
+        os.environ.update(REFRESH_MIN_MINUTES='10', REFRESH_MAX_MINUTES='30')
+        self.addCleanup(os.environ.pop, 'REFRESH_MIN_MINUTES')
+        self.addCleanup(os.environ.pop, 'REFRESH_MAX_MINUTES')
+        self.assertEqual(self.refresh(['Q'])[1], 10)
+        self.assertEqual(self.refresh(['Q'])[1], 20)
+        self.assertEqual(self.refresh(['Q'])[1], 30)
+        self.assertEqual(self.refresh(['R', 'S', 'T', 'U'])[1], 10)
+
+class SaveRefreshScheduleTest(RefreshScheduleTestCase):
+
+    def save(self, brokerNames, refreshedBrokers, leftoverSpans=set(), activeNames={}):
+        mqcommon.saveRefreshSchedule(schedulePath, brokerNames, refreshedBrokers, activeNames, leftoverSpans, now)
+
+    def test_brokers_with_leftover_work_stay_due(self):
+        mqcommon.refreshSchedule.update(a=entry(now - 60), b=entry(now - 60), c=entry(now - 60))
+        self.save(['a', 'b', 'c'], {'a': {'Q'}, 'b': {'Q'}, 'c': {'Q'}}, leftoverSpans={'b-2', 'c'})
+        self.assertFalse(mqcommon.isBrokerDue('a', now))
+        self.assertTrue(mqcommon.isBrokerDue('b', now))
+        self.assertTrue(mqcommon.isBrokerDue('c', now))
+
+    def test_only_changed_entries_are_written(self):
+        self.save(['a', 'b'], {'a': {'Q'}, 'b': {'Q'}})
+        self.assertEqual(sorted(mqcommon.ssm.parameters), [schedulePath + '/a', schedulePath + '/b'])
+        mqcommon.loadRefreshSchedule(schedulePath)
+        written = dict(mqcommon.ssm.parameters)
+        mqcommon.ssm.parameters.clear()
+        self.save(['a', 'b'], {'b': {'Q'}})
+        self.assertEqual(list(mqcommon.ssm.parameters), [schedulePath + '/b'])
+        self.assertNotEqual(mqcommon.ssm.parameters[schedulePath + '/b'], written[schedulePath + '/b'])
+
+    def test_round_trip_and_removed_brokers(self):
+        self.save(['a', 'b'], {'a': {'Q'}, 'b': {'Q', 'R'}}, activeNames={'b': 'b-2'})
+        saved = dict(mqcommon.refreshSchedule)
+        mqcommon.loadRefreshSchedule(schedulePath)
+        self.assertEqual(mqcommon.refreshSchedule, saved)
+        self.assertEqual(json.loads(mqcommon.ssm.parameters[schedulePath + '/b'])[2:], [2, digest(['Q', 'R']), 'b-2'])
+        self.save(['a'], {})
+        self.assertEqual(list(mqcommon.ssm.parameters), [schedulePath + '/a'])
+
+    def test_failed_write_does_not_fail_the_run(self):
+        def failingPutParameter(**kwargs):
+            raise Exception('ValidationException')
+        mqcommon.ssm.put_parameter = failingPutParameter
+        self.addCleanup(delattr, mqcommon.ssm, 'put_parameter')
+        self.save(['a'], {'a': {'Q'}})
+        self.assertEqual(mqcommon.ssm.parameters, {})
+        self.assertNotIn('a', mqcommon.refreshScheduleValues)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import contextlib
+import io
+import os
+import unittest
+
+import boto3stub
+import mqcommon
+
+class StubContext:
+    def __init__(self, *remainingMillis):
+        self.remainingMillis = list(remainingMillis)
+
+    # Returns the times in order, then keeps returning the last one.
+    def get_remaining_time_in_millis(self):
+        if len(self.remainingMillis) > 1:
+            return self.remainingMillis.pop(0)
+        return self.remainingMillis[0]
+
+class DrainWorkTest(unittest.TestCase):
+
+    def setUp(self):
+        del mqcommon.workQueue[:]
+        self.completed = []
+
+    def schedule(self, reason, description, spanName):
+        mqcommon.scheduleWork(reason, description, spanName, self.completed.append, description)
+
+    def drain(self, context):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            leftoverSpans = mqcommon.drainWork(context)
+        return leftoverSpans, output.getvalue()
+
+    def test_work_drains_in_priority_order(self):
+        self.schedule('refresh', 'refresh a', 'a-1:write')
+        self.schedule('resized dashboard', 'resized a', 'a-1:write')
+        self.schedule('missing alarm', 'alarm b', 'b:alarms')
+        self.schedule('refresh', 'refresh b', 'b-1:write')
+        self.schedule('missing dashboard', 'dashboard b', 'b-1:write')
+        leftoverSpans, output = self.drain(None)
+        self.assertEqual(self.completed, ['dashboard b', 'alarm b', 'resized a', 'refresh a', 'refresh b'])
+        self.assertEqual(leftoverSpans, set())
+        self.assertIn("Scheduled work: 5 completed, 0 left over {}", output)
+
+    def test_leftover_work_is_reported_by_span(self):
+        self.schedule('refresh', 'refresh a', 'a-1:write')
+        self.schedule('missing dashboard', 'dashboard b', 'b-1:write')
+        self.schedule('refresh', 'alarms c', 'c:alarms')
+        self.schedule('missing alarm', 'alarm b', 'b:alarms')
+        leftoverSpans, output = self.drain(StubContext(60000, 60000, 1000))
+        self.assertEqual(self.completed, ['dashboard b', 'alarm b'])
+        self.assertEqual(leftoverSpans, {'a-1', 'c'})
+        self.assertIn('Scheduled work: 2 completed, 2 left over {"refresh": 2}', output)
+        self.assertIn("Left over (refresh): refresh a", output)
+        self.assertIn("Left over (refresh): alarms c", output)
+
+    def test_nothing_runs_inside_the_reserve(self):
+        self.schedule('missing dashboard', 'dashboard a', 'a-1:write')
+        leftoverSpans, output = self.drain(StubContext(4999))
+        self.assertEqual(self.completed, [])
+        self.assertEqual(leftoverSpans, {'a-1'})
+
+class HasTimeToDiscoverTest(unittest.TestCase):
+
+    def test_without_context(self):
+        self.assertTrue(mqcommon.hasTimeToDiscover(None))
+
+    def test_reserve_and_drain_margin(self):
+        self.assertTrue(mqcommon.hasTimeToDiscover(StubContext(20000)))
+        self.assertFalse(mqcommon.hasTimeToDiscover(StubContext(19999)))
+
+    def test_reserve_from_environment(self):
+        os.environ['DRAIN_MARGIN_MS'] = '1000'
+        self.addCleanup(os.environ.pop, 'DRAIN_MARGIN_MS')
+        self.assertTrue(mqcommon.hasTimeToDiscover(StubContext(6000)))
+        self.assertFalse(mqcommon.hasTimeToDiscover(StubContext(5999)))
+
+if __name__ == '__main__':
+    unittest.main()